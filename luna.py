@@ -1,4 +1,7 @@
-import os, sys, threading, shutil, urllib.request, zipfile, json, csv, time
+import os, sys, threading, shutil, urllib.request, urllib.parse, zipfile, json, csv, time, subprocess, unicodedata, re, itertools, random, heapq, tempfile, base64
+from collections import Counter, deque
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import tkinter as tk
@@ -19,6 +22,12 @@ DOWNLOADS = USER_BASE / "downloads"
 PLAYLISTS_FILE = USER_BASE / "playlists.json"
 HISTORY_FILE = USER_BASE / "history.csv"
 THUMBNAIL_CACHE = USER_BASE / "thumbnails"
+CACHE_INDEX_FILE = USER_BASE / "cache.json"
+LIBRARY_INDEX_FILE = USER_BASE / "library_index.json"
+RESUME_FILE = USER_BASE / "resume.json"
+QUEUE_FILE = USER_BASE / "queue.json"
+QUEUE_STATE_FILE = USER_BASE / "queue_state.json"
+AUDIO_EXTS = (".mp3", ".ogg") # Containers a cached song can be in
 
 for path in [DOWNLOADS, THUMBNAIL_CACHE]:
     os.makedirs(path, exist_ok=True)
@@ -32,6 +41,65 @@ def cleanname(s: str) -> str:
     keep = (" ", ".", "_", "-", "(", ")", "[", "]")
     return "".join(c for c in s if c.isalnum() or c in keep).strip()
 
+# --- Track registry ---
+# Every video id maps to exactly one Track, shared by all playlists, search results and the library
+# index. Tracks answer the same entry["title"] / entry.get("thumbnail") lookups the old dicts did.
+class Track:
+    __slots__ = ("id", "title", "thumbnail")
+
+    def __init__(self, id, title, thumbnail=None):
+        self.id = id
+        self.title = title
+        self.thumbnail = thumbnail
+
+    @property
+    def url(self):
+        return f"https://www.youtube.com/watch?v={self.id}"
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in ("id", "title", "thumbnail", "url")
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self else default
+
+    def to_dict(self):
+        return {"title": self.title, "url": self.url, "id": self.id, "thumbnail": self.thumbnail}
+
+    def __repr__(self):
+        return f"Track({self.id!r}, {self.title!r})"
+
+track_registry = {} # video id -> Track
+guessed_titles = set() # ids whose title was recovered from a cleanname'd file name
+retitled_ids = set() # ids whose guessed title was replaced and still needs re-indexing
+registry_lock = threading.Lock()
+
+def intern_track(data, guessed=False):
+    """Returns the shared Track for data["id"], creating it on first sight.
+
+    A title guessed from a file name (guessed=True) is replaced by the first real title seen later.
+    """
+    if isinstance(data, Track):
+        return data
+    with registry_lock:
+        track = track_registry.get(data["id"])
+        if track is None:
+            track = track_registry[data["id"]] = Track(data["id"], data["title"], data.get("thumbnail"))
+            if guessed:
+                guessed_titles.add(track.id)
+        elif not guessed and track.id in guessed_titles:
+            if track.title != data["title"]:
+                track.title = data["title"]
+                retitled_ids.add(track.id)
+            guessed_titles.discard(track.id)
+        if data.get("thumbnail") and not track.thumbnail:
+            track.thumbnail = data["thumbnail"]
+        return track
+
 def download_ffmpeg_windows(dest_dir):
     zip_url = "https://github.com/GyanD/codexffmpeg/releases/download/7.1.1/ffmpeg-7.1.1-essentials_build.zip"
     zip_path = os.path.join(dest_dir, "ffmpeg-7.1.1-essentials_build.zip")
@@ -67,26 +135,485 @@ pygame.mixer.init()
 def append_history(title, url):
     with open(HISTORY_FILE, "a", newline="", encoding="utf-8") as f:
         csv.writer(f).writerow([datetime.now().isoformat(sep=' ', timespec='seconds'), title, url])
+    vid = video_id_from_url(url)
+    if vid:
+        index_track({"id": vid, "title": title})
 
 def load_playlists():
     if not os.path.exists(PLAYLISTS_FILE):
         return {}
     try:
         with open(PLAYLISTS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+            data = json.load(f)
+        return {name: [intern_track(item) for item in items] for name, items in data.items()}
     except Exception:
         return {}
 
 def save_playlists(p):
     with open(PLAYLISTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(p, f, indent=2)
+        json.dump({name: [t.to_dict() for t in items] for name, items in p.items()}, f, indent=2)
 
 playlists = load_playlists()
 
+# --- Cache metadata (codec/bitrate/size of every file in DOWNLOADS) ---
+cache_lock = threading.Lock()
+
+def load_cache_index():
+    if not os.path.exists(CACHE_INDEX_FILE):
+        return {}
+    try:
+        with open(CACHE_INDEX_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_cache_index(index):
+    # Write to a temp file and swap it in so a crash never leaves a half-written index
+    tmp = str(CACHE_INDEX_FILE) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp, CACHE_INDEX_FILE)
+
+cache_index = load_cache_index()
+
+def cache_key(path):
+    """Cache entries are keyed by the canonical .mp3 name, whatever container the file is in now."""
+    return os.path.splitext(os.path.basename(path))[0] + ".mp3"
+
+def record_cache_entry(path, codec, bitrate, tier="high"):
+    with cache_lock:
+        cache_index[cache_key(path)] = {
+            "file": os.path.basename(path),
+            "codec": codec,
+            "bitrate": int(bitrate),
+            "size": os.path.getsize(path),
+            "tier": tier,
+        }
+        save_cache_index(cache_index)
+
+def record_cache_duration(path, seconds):
+    with cache_lock:
+        meta = cache_index.get(cache_key(path))
+        if meta and meta.get("file") == os.path.basename(path):
+            meta["duration"] = round(seconds, 2)
+            save_cache_index(cache_index)
+
+def forget_cache_entry(path):
+    with cache_lock:
+        if cache_index.pop(cache_key(path), None) is not None:
+            save_cache_index(cache_index)
+    vid = video_id_from_filename(path)
+    if vid:
+        with library_lock:
+            library_cached.discard(vid)
+            library_cached_docs.discard(library_ids.get(vid))
+
+# --- Offline library index (trigram index over playlists, downloads and history) ---
+library_lock = threading.Lock()
+library_tracks = [] # doc number -> Track
+library_norms = [] # doc number -> normalized title
+library_ids = {} # video id -> doc number
+library_grams = {} # trigram -> ascending list (or array) of doc numbers
+library_cached = set() # ids that have an audio file in DOWNLOADS
+library_cached_docs = set() # the same tracks as doc numbers, for set operations against postings
+FUZZY_SCORE_BUDGET = 30000 # Max posting entries scored per fuzzy query
+library_short_docs = set() # titles under 3 characters, which have no trigrams
+SEARCH_WALK_BUDGET = 5000 # Posting entries checked one by one before switching to set operations
+library_dirty = False
+library_loaded = threading.Event() # Set once library_index.json is in memory; saving before that would truncate it
+
+def normalize_title(s):
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(c for c in s if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^\w]+", " ", s).split())
+
+def title_grams(norm):
+    return {norm[i:i + 3] for i in range(len(norm) - 2)}
+
+def video_id_from_url(url):
+    return (urllib.parse.parse_qs(urllib.parse.urlparse(url or "").query).get("v") or [None])[0]
+
+def video_id_from_filename(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem.rsplit(" - ", 1)[1] if " - " in stem else None
+
+def reindex_title(doc, norm):
+    """Points doc at its corrected title. Caller holds library_lock."""
+    global library_dirty
+    if library_norms[doc] == norm:
+        return
+    # Stale grams only add candidates that then fail the containment check
+    for g in title_grams(norm) - title_grams(library_norms[doc]):
+        library_grams.setdefault(g, []).append(doc)
+    library_norms[doc] = norm
+    if len(norm) < 3:
+        library_short_docs.add(doc)
+    library_dirty = True
+
+def pack_postings(grams):
+    """Stores the posting lists as one little-endian uint32 array: a fraction of the size and parse
+    time of nested JSON lists, which for a large library held up startup for seconds."""
+    keys = list(grams)
+    flat = array("I")
+    for g in keys:
+        flat.extend(grams[g])
+    if sys.byteorder == "big":
+        flat.byteswap()
+    return {"keys": keys, "lengths": [len(grams[g]) for g in keys], "postings": base64.b64encode(flat.tobytes()).decode("ascii")}
+
+def unpack_postings(packed):
+    if "postings" not in packed: # Saved before postings were packed: already gram -> list
+        return packed
+    flat = array("I")
+    flat.frombytes(base64.b64decode(packed["postings"]))
+    if sys.byteorder == "big":
+        flat.byteswap()
+    # Kept as arrays: search only iterates, intersects and appends, and this skips creating millions of ints
+    grams, pos = {}, 0
+    for g, n in zip(packed["keys"], packed["lengths"]):
+        grams[g] = flat[pos:pos + n]
+        pos += n
+    return grams
+
+def index_track(entry, cached=False, guessed=False):
+    """Adds a track to the offline index. Safe to call from any thread; known ids are a no-op
+    unless their title was corrected since they were indexed."""
+    global library_dirty
+    track = intern_track(entry, guessed)
+    with registry_lock:
+        retitled = track.id in retitled_ids
+        retitled_ids.discard(track.id)
+    with library_lock:
+        if cached:
+            library_cached.add(track.id)
+        doc = library_ids.get(track.id)
+        if doc is not None:
+            if cached:
+                library_cached_docs.add(doc)
+            if retitled:
+                reindex_title(doc, normalize_title(track.title))
+            return
+        norm = normalize_title(track.title)
+        doc = len(library_tracks)
+        library_tracks.append(track)
+        library_norms.append(norm)
+        library_ids[track.id] = doc
+        if cached:
+            library_cached_docs.add(doc)
+        if len(norm) < 3:
+            library_short_docs.add(doc)
+        for g in title_grams(norm):
+            library_grams.setdefault(g, []).append(doc)
+        library_dirty = True
+
+def load_library_index():
+    """Swaps in the persisted index. Tracks indexed while it was loading are returned for re-adding."""
+    global library_tracks, library_norms, library_grams, library_ids, library_short_docs, library_cached_docs
+    if not os.path.exists(LIBRARY_INDEX_FILE):
+        library_loaded.set()
+        return []
+    try:
+        # Parsed outside library_lock, so searches meanwhile run against what is already indexed
+        with open(LIBRARY_INDEX_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        tracks = [intern_track({"id": row[0], "title": row[1], "thumbnail": row[2]}, guessed=row[3]) for row in data["tracks"]]
+        ids = {t.id: i for i, t in enumerate(tracks)}
+        norms = data["norms"]
+        grams = unpack_postings(data["grams"])
+        # A playlist loaded earlier may already have replaced a guessed title
+        changed = [i for i, (t, row) in enumerate(zip(tracks, data["tracks"])) if t.title != row[1]]
+    except Exception as e:
+        print("library index load error:", e)
+        library_loaded.set()
+        return []
+    with library_lock:
+        pending = library_tracks
+        library_tracks, library_norms, library_grams, library_ids = tracks, norms, grams, ids
+        library_short_docs = {i for i, n in enumerate(norms) if len(n) < 3}
+        library_cached_docs = {ids[v] for v in library_cached if v in ids}
+        for i in changed:
+            reindex_title(i, normalize_title(tracks[i].title))
+    library_loaded.set()
+    return [t for t in pending if t.id not in ids]
+
+def save_library_index():
+    global library_dirty
+    if not library_loaded.is_set():
+        return
+    with library_lock:
+        if not library_dirty:
+            return
+        tmp = str(LIBRARY_INDEX_FILE) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            tracks = [[t.id, t.title, t.thumbnail, t.id in guessed_titles] for t in library_tracks]
+            json.dump({"tracks": tracks, "norms": library_norms, "grams": pack_postings(library_grams)}, f, separators=(",", ":"))
+        os.replace(tmp, LIBRARY_INDEX_FILE)
+        library_dirty = False
+
+def build_library_index():
+    """Loads the persisted index, then folds in anything added to the library since it was saved."""
+    for track in load_library_index():
+        index_track(track, cached=track.id in library_cached)
+    for pl in playlists.values():
+        for item in pl:
+            index_track(item)
+    try:
+        with open(HISTORY_FILE, "r", newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                vid = video_id_from_url(row.get("video_url"))
+                if vid and row.get("title"):
+                    index_track({"id": vid, "title": row["title"]})
+    except Exception as e:
+        print("history index error:", e)
+    # Downloads last: their titles went through cleanname, so they only fill in unseen ids
+    for f in os.listdir(DOWNLOADS):
+        if f.lower().endswith(AUDIO_EXTS):
+            vid = video_id_from_filename(f)
+            if vid:
+                index_track({"id": vid, "title": os.path.splitext(f)[0].rsplit(" - ", 1)[0]}, cached=True, guessed=True)
+    save_library_index()
+
+def search_library(query, limit=50):
+    """Substring matches first, then fuzzy (shared trigram) matches; cached tracks rank first in each group."""
+    norm = normalize_title(query)
+    if not norm:
+        return []
+    with library_lock:
+        grams = title_grams(norm)
+        postings = sorted((library_grams.get(g, ()) for g in grams), key=len)
+        cached, uncached = [], []
+        if grams and len(postings[0]) > SEARCH_WALK_BUDGET:
+            # A common term: walk the start of the shortest posting list first, which usually fills a
+            # page of cached hits on its own
+            for d in itertools.islice(postings[0], SEARCH_WALK_BUDGET):
+                if norm in library_norms[d]:
+                    if d in library_cached_docs:
+                        cached.append(d)
+                        if len(cached) >= limit:
+                            break
+                    elif len(uncached) < limit:
+                        uncached.append(d)
+        if len(cached) >= limit:
+            candidates = cached_candidates = ()
+        elif grams:
+            # Narrow to docs holding the three rarest query trigrams with C-level set operations;
+            # the containment check below then rejects the few that don't hold the whole string
+            candidates = set(postings[0])
+            for plist in postings[1:3]:
+                candidates.intersection_update(plist)
+            cached_candidates = candidates & library_cached_docs
+            cached, uncached = [], []
+        else:
+            # 1-2 character query: union the postings of trigrams containing it when that is small,
+            # otherwise a plain scan, which stops early because such a query matches a lot
+            containing = [plist for g, plist in library_grams.items() if norm in g]
+            if sum(map(len, containing)) < len(library_norms) // 4:
+                candidates = set(library_short_docs).union(*containing)
+                cached_candidates = candidates & library_cached_docs
+            else:
+                candidates, cached_candidates = range(len(library_norms)), library_cached_docs
+
+        for d in cached_candidates:
+            if norm in library_norms[d]:
+                cached.append(d)
+                if len(cached) >= limit:
+                    break
+        if len(cached) < limit:
+            for d in candidates:
+                if d not in library_cached_docs and norm in library_norms[d]:
+                    uncached.append(d)
+                    if len(uncached) >= limit:
+                        break
+
+        fuzzy_cached, fuzzy_uncached = [], []
+        if len(cached) + len(uncached) < limit and len(grams) > 1:
+            # Score the rarest trigrams only, within a fixed budget, so common grams like "the" can't blow it
+            scores, scored, budget = Counter(), 0, FUZZY_SCORE_BUDGET
+            for plist in [p for p in postings if p][:8]:
+                if scored and len(plist) > budget:
+                    break
+                scores.update(plist)
+                scored += 1
+                budget -= len(plist)
+            found = set(cached) | set(uncached)
+            needed = max(1, (scored + 1) // 2)
+            for d, n in scores.most_common(2 * limit + len(found)):
+                if n < needed:
+                    break
+                if d not in found:
+                    (fuzzy_cached if d in library_cached_docs else fuzzy_uncached).append(d)
+
+        by_length = lambda d: len(library_norms[d])
+        ranked = heapq.nsmallest(limit, cached, key=by_length)
+        ranked += heapq.nsmallest(limit - len(ranked), uncached, key=by_length) + fuzzy_cached + fuzzy_uncached
+        return [library_tracks[d] for d in ranked[:limit]]
+
+# Off the main thread: parsing a large index would otherwise hold up the first window
+threading.Thread(target=build_library_index, daemon=True).start()
+
+# --- Play queue ---
+class PlayQueue:
+    """Play order for one playlist: a permutation of its indices plus a "play next" list.
+
+    Shuffling and sorting only rewrite the permutation (persisted in queue.json), never the
+    playlist itself, and next/previous are O(1) moves along it. The small, frequently changing
+    part (position, current song, "play next" list) is saved separately in queue_state.json.
+    """
+
+    def __init__(self, playlist=None, order=None, position=-1, current=-1, up_next=(), detour=False):
+        self.playlist = playlist # Playlist name
+        self.order = order or [] # Queue position -> playlist index
+        self.position = position # Queue position of the last song taken from order
+        self.current = current # Playlist index of the song playing now (-1 if none)
+        self.up_next = deque(up_next) # Playlist indices queued with "Play Next"
+        self.detour = detour # True while the current song came from up_next rather than order
+        self.lock = threading.RLock() # Moved by both the Tk thread and playback workers
+
+    def attach(self, playlist, size):
+        """Keeps the saved order when reopening the same playlist, otherwise starts in playlist order."""
+        with self.lock:
+            if playlist != self.playlist or len(self.order) != size:
+                self.playlist, self.order, self.position, self.current = playlist, list(range(size)), -1, -1
+                self.up_next, self.detour = deque(), False
+
+    def rows(self):
+        """Playlist indices in queue order (a copy, safe to iterate while the queue changes)."""
+        with self.lock:
+            return list(self.order)
+
+    def at(self, rows):
+        """Maps queue rows, e.g. listbox selections, to playlist indices."""
+        with self.lock:
+            return [self.order[r] for r in rows if 0 <= r < len(self.order)]
+
+    def set_current(self, index):
+        """Records the song playing now (-1 for none) and saves it."""
+        with self.lock:
+            self.current = index
+            self.save_state()
+
+    def jump(self, position):
+        with self.lock:
+            self.position = position
+            self.current = self.order[position]
+            self.detour = False
+            return self.current
+
+    def advance(self, wrap=True):
+        """Moves to the next song and returns its playlist index, or None at the end when not wrapping."""
+        with self.lock:
+            if self.up_next:
+                self.current = self.up_next.popleft()
+                self.detour = True
+                return self.current
+            if not self.order or (not wrap and self.position + 1 >= len(self.order)):
+                return None
+            return self.jump((self.position + 1) % len(self.order))
+
+    def back(self):
+        with self.lock:
+            if not self.order:
+                return None
+            if self.detour and 0 <= self.position < len(self.order):
+                # Leaving a "Play Next" song: go back to the song that was playing before it
+                return self.jump(self.position)
+            return self.jump((self.position - 1) % len(self.order))
+
+    def play_next(self, index):
+        with self.lock:
+            self.up_next.append(index)
+
+    def shuffle(self):
+        with self.lock:
+            # The song at the current position moves to the front so "next" continues into the new
+            # order, whether it is still playing or was stopped
+            if 0 <= self.position < len(self.order):
+                head = self.order.pop(self.position)
+                random.shuffle(self.order)
+                self.order.insert(0, head)
+                self.position = 0
+            else:
+                random.shuffle(self.order)
+
+    def sort(self, items, key):
+        with self.lock:
+            anchor = self.order[self.position] if 0 <= self.position < len(self.order) else None
+            self.order.sort(key=lambda i: key(items[i]))
+            if anchor is not None:
+                self.position = self.order.index(anchor)
+
+    def appended(self, index):
+        with self.lock:
+            self.order.append(index)
+
+    def removed(self, indices):
+        """Renumbers the queue after the playlist entries at indices were deleted."""
+        with self.lock:
+            removed = set(indices)
+            shift, new_index = 0, {}
+            for i in range(len(self.order)):
+                if i in removed:
+                    shift += 1
+                else:
+                    new_index[i] = i - shift
+            order, position = [], -1
+            for pos, i in enumerate(self.order):
+                if i in new_index:
+                    if pos <= self.position:
+                        position = len(order)
+                    order.append(new_index[i])
+            self.order, self.position = order, position
+            self.current = new_index.get(self.current, -1)
+            self.up_next = deque(new_index[i] for i in self.up_next if i in new_index)
+
+    def save_state(self):
+        """Saves position, current song and "play next" list; cheap enough for every song change."""
+        with self.lock:
+            tmp = str(QUEUE_STATE_FILE) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"playlist": self.playlist, "position": self.position, "current": self.current,
+                           "up_next": list(self.up_next), "detour": self.detour}, f, separators=(",", ":"))
+            os.replace(tmp, QUEUE_STATE_FILE)
+
+    def save(self):
+        """Saves the whole queue; only needed after the order changed, and on exit."""
+        with self.lock:
+            tmp = str(QUEUE_FILE) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"playlist": self.playlist, "order": self.order}, f, separators=(",", ":"))
+            os.replace(tmp, QUEUE_FILE)
+            self.save_state()
+
+    @classmethod
+    def load(cls):
+        try:
+            with open(QUEUE_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            size = len(playlists.get(data["playlist"], ()))
+            order = data["order"]
+            # Discard the queue if the playlist changed outside the app
+            if not size or len(order) != size or set(order) != set(range(size)):
+                return cls()
+        except Exception:
+            return cls()
+        queue = cls(data["playlist"], order)
+        try:
+            with open(QUEUE_STATE_FILE, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state["playlist"] == queue.playlist:
+                queue.position = state["position"] if -1 <= state["position"] < size else -1
+                queue.current = state["current"] if -1 <= state["current"] < size else -1
+                queue.up_next = deque(i for i in state["up_next"] if 0 <= i < size)
+                queue.detour = bool(state.get("detour"))
+        except Exception:
+            pass # Keep the order, start from the top
+        return queue
+
+play_queue = PlayQueue.load()
+
 # --- Global Playback State ---
-current_playlist_name = None
-current_playlist_items = [] # This will hold the actual list of song dicts for the current playlist
-current_song_index = -1 # Index within current_playlist_items
+current_playlist_name = play_queue.playlist # Restored from the saved queue so Next/Prev work after a restart
+current_playlist_items = playlists.get(current_playlist_name, []) # The actual list of tracks for the current playlist
 current_playing_entry = None # The full entry dict of the currently playing song
 
 # --- Search / download logic ---
@@ -105,16 +632,22 @@ def yt_search(query, max_results=10):
                 if 'thumbnails' in e and e['thumbnails']:
                     # Get the largest thumbnail available
                     thumbnail_url = max(e['thumbnails'], key=lambda x: x.get('width', 0) * x.get('height', 0)).get('url')
-                results.append({"id": vid, "title": title, "url": f"https://www.youtube.com/watch?v={vid}", "thumbnail": thumbnail_url})
+                results.append(intern_track({"id": vid, "title": title, "thumbnail": thumbnail_url}))
             return results
     except Exception as e:
-        messagebox.showerror("Search error", str(e))
+        ui_dialog(messagebox.showerror, "Search error", str(e))
         return []
 
 def cached_mp3_path(entry):
     name = f"{entry['title']} - {entry['id']}.mp3"
     name = cleanname(name)
-    return os.path.join(DOWNLOADS, name)
+    path = os.path.join(DOWNLOADS, name)
+    if not os.path.exists(path):
+        # The library may have been re-encoded into another container by transcode_library
+        moved = cache_index.get(name, {}).get("file")
+        if moved and os.path.exists(os.path.join(DOWNLOADS, moved)):
+            return os.path.join(DOWNLOADS, moved)
+    return path
 
 def cached_thumbnail_path(entry):
     if 'thumbnail' not in entry or not entry['thumbnail']:
@@ -137,42 +670,99 @@ def download_thumbnail(entry):
     try:
         urllib.request.urlretrieve(thumbnail_url, thumb_path)
         return thumb_path
-    except Exception:
-        root.playback_window.thumbnail_label.config(image='')
-        root.playback_window.thumbnail_label.image = None
-
-
-def download_audio_to_mp3(video_url, entry):
-    outtmpl = os.path.join(DOWNLOADS, "%(title)s - %(id)s.%(ext)s")
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": outtmpl,
-        "postprocessors": [{
-            "key": "FFmpegExtractAudio",
-            "preferredcodec": "mp3",
-            "preferredquality": "192"
-        }],
-        "ffmpeg_location": FFMPEG_LOCATION,
-        "quiet": True,
-        "nocheckcertificate": True,
-    }
+    except Exception as e:
+        print("thumbnail download error:", e) # The display falls back to no thumbnail
+        return None
 
-    def enforce_download_limit():
-        playlist_files = {cleanname(f"{item['title']} - {item['id']}.mp3") for pl in playlists.values() for item in pl}
-        downloaded_files = [os.path.join(DOWNLOADS, f) for f in os.listdir(DOWNLOADS) if f.endswith(".mp3")]
-        non_playlist_files = [f for f in downloaded_files if os.path.basename(f) not in playlist_files]
-        non_playlist_files.sort(key=os.path.getmtime)
-        while len(non_playlist_files) > 5:
-            while len(non_playlist_files) > 5:
-                os.remove(non_playlist_files.pop(0))
 
+# --- Download quality tiers ---
+# "low" starts playing quickly on slow or metered links, "high" is for offline listening. The
+# "auto" policy picks the best format expected to finish within TARGET_FIRST_PLAY_SECONDS at the
+# throughput measured on recent downloads, and marks the cache entry low-tier if it had to step down.
+QUALITY_TIERS = {
+    "low": {"max_abr": 70, "preferredquality": "96"},
+    "high": {"max_abr": None, "preferredquality": "192"},
+}
+TARGET_FIRST_PLAY_SECONDS = 8.0
+UPGRADE_IDLE_SECONDS = 60
+UPGRADE_STAGING = DOWNLOADS / "upgrade"
+
+download_state_lock = threading.Lock()
+library_rewrite_lock = threading.Lock() # Held by transcode_library and by an idle upgrade; both replace cached files
+throughput_samples = deque(maxlen=8) # (bytes, seconds) of recent downloads
+active_downloads = 0
+background_upgrade_enabled = False
+
+def record_throughput(d):
+    """yt-dlp progress hook."""
+    if d.get("status") == "finished" and d.get("elapsed"):
+        size = d.get("total_bytes") or d.get("downloaded_bytes")
+        if size:
+            with download_state_lock:
+                throughput_samples.append((size, d["elapsed"]))
+
+def measured_throughput():
+    """Bytes per second over recent downloads, or None before anything was downloaded."""
+    with download_state_lock:
+        seconds = sum(t for _, t in throughput_samples)
+        return sum(b for b, _ in throughput_samples) / seconds if seconds else None
+
+def choose_audio_format(formats, duration, tier):
+    """Returns (format, tier) for the requested tier ("low", "high" or "auto")."""
+    audio = [f for f in formats if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none") and f.get("format_id")]
+    if not audio:
+        return None, "high" if tier == "auto" else tier
+    audio.sort(key=lambda f: f.get("abr") or f.get("tbr") or 0)
+
+    def in_tier(name):
+        cap = QUALITY_TIERS[name]["max_abr"]
+        return [f for f in audio if cap is None or (f.get("abr") or f.get("tbr") or 0) <= cap] or audio[:1]
+
+    if tier != "auto":
+        return in_tier(tier)[-1], tier
+
+    bps = measured_throughput()
+    def fits(f):
+        size = f.get("filesize") or f.get("filesize_approx")
+        if not size and duration and (f.get("abr") or f.get("tbr")):
+            size = (f.get("abr") or f.get("tbr")) * 125 * duration # kbit/s -> bytes
+        return not bps or not size or size / bps <= TARGET_FIRST_PLAY_SECONDS
+
+    if fits(audio[-1]):
+        return audio[-1], "high"
+    fitting = [f for f in in_tier("low") if fits(f)]
+    return (fitting[-1] if fitting else audio[0]), "low"
+
+def fetch_audio(video_url, entry, tier, target_dir):
+    """Downloads and converts one song into target_dir. Returns (path, tier, bitrate) or None."""
+    global active_downloads
+    with download_state_lock:
+        active_downloads += 1
     try:
+        with yt_dlp.YoutubeDL({"quiet": True, "nocheckcertificate": True}) as probe:
+            info = probe.extract_info(video_url, download=False, process=False)
+        fmt, tier = choose_audio_format(info.get("formats") or [], info.get("duration"), tier)
+        quality = QUALITY_TIERS[tier]["preferredquality"]
+
+        ydl_opts = {
+            "format": f"{fmt['format_id']}/bestaudio/best" if fmt else "bestaudio/best",
+            "outtmpl": os.path.join(target_dir, "%(title)s - %(id)s.%(ext)s"),
+            "postprocessors": [{
+                "key": "FFmpegExtractAudio",
+                "preferredcodec": "mp3",
+                "preferredquality": quality
+            }],
+            "ffmpeg_location": FFMPEG_LOCATION,
+            "quiet": True,
+            "nocheckcertificate": True,
+            "progress_hooks": [record_throughput],
+        }
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
+            info = ydl.process_ie_result(info, download=True)
             base = ydl.prepare_filename(info)
             mp3_guess = os.path.splitext(base)[0] + ".mp3"
             final_name = cleanname(os.path.basename(mp3_guess))
-            final_path = os.path.join(DOWNLOADS, final_name)
+            final_path = os.path.join(target_dir, final_name)
             if os.path.exists(mp3_guess) and mp3_guess != final_path:
                 try:
                     os.replace(mp3_guess, final_path)
@@ -183,25 +773,423 @@ def download_audio_to_mp3(video_url, entry):
             elif os.path.exists(mp3_guess):
                 final_path = mp3_guess
             else:
-                for f in os.listdir(DOWNLOADS):
+                for f in os.listdir(target_dir):
                     if f.lower().endswith(".mp3") and entry["id"] in f:
-                        final_path = os.path.join(DOWNLOADS, f)
+                        final_path = os.path.join(target_dir, f)
                         break
                 else:
                     return None
-            enforce_download_limit()
-            return os.path.abspath(final_path)
+            return final_path, tier, quality
+    finally:
+        with download_state_lock:
+            active_downloads -= 1
+
+def register_download(final_path, entry, tier, quality):
+    record_cache_entry(final_path, "mp3", quality, tier)
+    index_track(entry, cached=True)
+    threading.Thread(target=ensure_frame_index, args=(final_path,), daemon=True).start()
+
+def download_audio_to_mp3(video_url, entry, tier="auto"):
+    def enforce_download_limit():
+        playlist_files = {cleanname(f"{item['title']} - {item['id']}.mp3") for pl in playlists.values() for item in pl}
+        downloaded_files = [os.path.join(DOWNLOADS, f) for f in os.listdir(DOWNLOADS) if f.endswith(AUDIO_EXTS)]
+        non_playlist_files = [f for f in downloaded_files if cache_key(f) not in playlist_files]
+        non_playlist_files.sort(key=os.path.getmtime)
+        while len(non_playlist_files) > 5:
+            while len(non_playlist_files) > 5:
+                old = non_playlist_files.pop(0)
+                os.remove(old)
+                forget_cache_entry(old)
+                remove_frame_index(old)
+
+    try:
+        fetched = fetch_audio(video_url, entry, tier, str(DOWNLOADS))
+        if not fetched:
+            return None
+        final_path, tier, quality = fetched
+        register_download(final_path, entry, tier, quality)
+        enforce_download_limit()
+        return os.path.abspath(final_path)
     except Exception as e:
         print("download error:", e)
 
+def upgrade_low_tier_song():
+    """Re-downloads one low-tier cache entry at the high tier. Returns True if one was upgraded."""
+    with cache_lock:
+        # Only untouched quick downloads; anything re-encoded since is marked "transcoded"
+        low = [meta["file"] for meta in cache_index.values()
+               if meta.get("tier") == "low" and meta.get("codec") == "mp3" and meta.get("bitrate") == int(QUALITY_TIERS["low"]["preferredquality"])]
+    for name in low:
+        if playback_active():
+            return False
+        path = os.path.join(DOWNLOADS, name)
+        vid = video_id_from_filename(path)
+        if not vid or not os.path.exists(path) or path == current_file: # The playing file is locked on Windows
+            continue
+        entry = track_registry.get(vid) or intern_track({"id": vid, "title": os.path.splitext(name)[0].rsplit(" - ", 1)[0]}, guessed=True)
+        os.makedirs(UPGRADE_STAGING, exist_ok=True)
+        try:
+            fetched = fetch_audio(entry.url, entry, "high", str(UPGRADE_STAGING))
+            if not fetched:
+                continue
+            staged, tier, quality = fetched
+            # Swap the new file in under the old name so playlists and the cache key still match
+            new_path = os.path.splitext(path)[0] + ".mp3"
+            os.replace(staged, new_path)
+            remove_frame_index(path)
+            if new_path != path:
+                os.remove(path)
+            register_download(new_path, entry, tier, quality)
+            return True
+        except Exception as e:
+            print("upgrade error:", e)
+        finally:
+            shutil.rmtree(UPGRADE_STAGING, ignore_errors=True)
+    return False
+
+def playback_active():
+    return playing and (paused or pygame.mixer.music.get_busy())
+
+def background_upgrade_loop():
+    """Upgrades low-tier songs one at a time while the option is on and the app is idle:
+    nothing downloading, nothing playing and no transcode_library run in progress."""
+    while True:
+        time.sleep(UPGRADE_IDLE_SECONDS)
+        if not background_upgrade_enabled:
+            continue
+        with download_state_lock:
+            busy = active_downloads > 0
+        if busy or playback_active():
+            continue
+        if not library_rewrite_lock.acquire(blocking=False): # A transcode run owns the cache files
+            continue
+        try:
+            upgrade_low_tier_song()
+        finally:
+            library_rewrite_lock.release()
+
+# --- Library maintenance (batch re-encoding) ---
+TRANSCODE_CODECS = {"mp3": ("libmp3lame", "mp3", ".mp3"), "ogg": ("libvorbis", "ogg", ".ogg")}
+TRANSCODE_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+TRANSCODE_NICENESS = 10
+TRANSCODE_SUFFIX = ".transcode.part" # Distinct from yt-dlp's own ".part" downloads
+
+def ffmpeg_executable():
+    if FFMPEG_LOCATION:
+        return os.path.join(FFMPEG_LOCATION, "ffmpeg.exe" if os.name == "nt" else "ffmpeg")
+    return shutil.which("ffmpeg")
+
+def run_ffmpeg(args, niceness):
+    """Runs ffmpeg at reduced priority so re-encoding never competes with playback."""
+    kwargs = {"stdout": subprocess.DEVNULL, "stderr": subprocess.PIPE, "stdin": subprocess.DEVNULL}
+    if os.name == "nt":
+        priority = subprocess.IDLE_PRIORITY_CLASS if niceness >= 15 else subprocess.BELOW_NORMAL_PRIORITY_CLASS
+        kwargs["creationflags"] = priority | subprocess.CREATE_NO_WINDOW # No console flash in the windowed build
+    cmd = [ffmpeg_executable(), "-nostdin", "-hide_banner"] + args
+    proc = subprocess.Popen(cmd, **kwargs)
+    if os.name != "nt" and niceness:
+        # Set from outside: preexec_fn isn't safe here because the transcode pool is multithreaded
+        try:
+            os.setpriority(os.PRIO_PROCESS, proc.pid, niceness)
+        except OSError:
+            pass # Already exited, or not permitted; priority is best effort
+    _, stderr = proc.communicate()
+    return subprocess.CompletedProcess(cmd, proc.returncode, None, stderr)
+
+def probe_duration(path, niceness=TRANSCODE_NICENESS):
+    """Reads the track length (seconds) from the container header, or None if ffmpeg can't tell."""
+    if not ffmpeg_executable():
+        return None
+    proc = run_ffmpeg(["-i", path], niceness) # No output file: ffmpeg prints the input info and exits
+    match = re.search(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", proc.stderr or b"")
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def decodes_cleanly(path, niceness=TRANSCODE_NICENESS):
+    proc = run_ffmpeg(["-v", "error", "-i", path, "-f", "null", "-"], niceness)
+    return proc.returncode == 0 and not proc.stderr.strip()
+
+def transcode_file(src, codec, bitrate, niceness, repair):
+    """Re-encodes one cached file. Returns bytes saved, or None when the file was left alone."""
+    key = cache_key(src)
+    ext = os.path.splitext(src)[1].lower()
+    with cache_lock:
+        meta = dict(cache_index.get(key) or {"codec": ext.lstrip("."), "bitrate": 192})
+    # Files already at (or below) the target are skipped, which is what makes an interrupted run resumable
+    needs_work = meta["codec"] != codec or meta["bitrate"] > bitrate
+    if not needs_work and not (repair and not decodes_cleanly(src, niceness)):
+        return None
+
+    encoder, fmt, new_ext = TRANSCODE_CODECS[codec]
+    dst = os.path.splitext(src)[0] + new_ext
+    # Own temp name per job, so two jobs can never write the same output
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(src), prefix=os.path.basename(dst) + ".", suffix=TRANSCODE_SUFFIX)
+    os.close(fd)
+    old_size = os.path.getsize(src)
+    proc = run_ffmpeg(["-y", "-v", "error", "-err_detect", "ignore_err", "-i", src,
+                       "-vn", "-map_metadata", "0", "-c:a", encoder, "-b:a", f"{bitrate}k", "-f", fmt, tmp], niceness)
+    if proc.returncode != 0 or not os.path.exists(tmp) or os.path.getsize(tmp) == 0:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise RuntimeError(proc.stderr.decode(errors="replace").strip() or "ffmpeg failed")
+
+    os.replace(tmp, dst)
+    if dst != src:
+        try:
+            os.remove(src)
+        except OSError:
+            # Locked by playback or already evicted: undo, so the song never exists in two containers
+            os.remove(dst)
+            raise
+    remove_frame_index(src)
+    # The user chose this size deliberately; the idle upgrade only touches "low" entries
+    record_cache_entry(dst, codec, bitrate, "transcoded")
+    return old_size - os.path.getsize(dst)
+
+def transcode_library(codec="mp3", bitrate=128, workers=TRANSCODE_WORKERS, niceness=TRANSCODE_NICENESS, repair=False):
+    """Re-encodes every cached song to codec/bitrate. Returns (converted, failed, bytes_saved)."""
+    if codec not in TRANSCODE_CODECS:
+        raise ValueError(f"Unsupported codec: {codec}")
+    if not ffmpeg_executable():
+        raise RuntimeError("FFmpeg is not available.")
+
+    # Waits for an in-flight idle upgrade, and keeps new ones out until this run is done
+    with library_rewrite_lock:
+        # Leftovers from an interrupted run; yt-dlp's in-progress files are left alone
+        for f in os.listdir(DOWNLOADS):
+            if f.endswith(TRANSCODE_SUFFIX):
+                try:
+                    os.remove(os.path.join(DOWNLOADS, f))
+                except OSError as e:
+                    print("transcode cleanup error:", f, e)
+
+        # Skip yt-dlp intermediates such as "<title> - <id>.temp.mp3" that a running download may still write
+        files = [os.path.join(DOWNLOADS, f) for f in os.listdir(DOWNLOADS)
+                 if f.lower().endswith(AUDIO_EXTS) and not os.path.splitext(f)[0].lower().endswith(".temp")]
+        files = [f for f in files if f != current_file] # The playing file is locked on Windows
+
+        # One job per song: if a song exists in two containers, only the one cache.json points at
+        # (or else the original .mp3) is re-encoded
+        by_key = {}
+        for f in files:
+            by_key.setdefault(cache_key(f), []).append(f)
+        files = []
+        for key, paths in by_key.items():
+            if len(paths) > 1:
+                with cache_lock:
+                    recorded = (cache_index.get(key) or {}).get("file")
+                paths = [f for f in paths if os.path.basename(f) == recorded] or \
+                        [f for f in paths if f.lower().endswith(".mp3")] or paths[:1]
+            files.append(paths[0])
+
+        converted, failed, saved = 0, [], 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            jobs = {pool.submit(transcode_file, f, codec, int(bitrate), niceness, repair): f for f in files}
+            for job, f in jobs.items():
+                try:
+                    result = job.result()
+                except Exception as e:
+                    print("transcode error:", f, e)
+                    failed.append(os.path.basename(f))
+                    continue
+                if result is not None:
+                    converted += 1
+                    saved += result
+        return converted, failed, saved
+
+# --- MP3 frame index (seeking) ---
+# Byte offset of every MP3 frame, stored as "<file>.idx" next to the cached song. Seeking opens
+# the file at the target frame and hands the stream to pygame, so nothing before it is decoded.
+MP3_BITRATES = {
+    True: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320], # MPEG-1 Layer III
+    False: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160], # MPEG-2/2.5 Layer III
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+def frame_index_path(path):
+    return path + ".idx"
+
+def remove_frame_index(path):
+    try:
+        os.remove(frame_index_path(path))
+    except FileNotFoundError:
+        pass
+
+def scan_mp3_frames(path):
+    """Returns (sample_rate, samples_per_frame, offsets) for a Layer III file, or None."""
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    if data[:3] == b"ID3":
+        pos = 10 + ((data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f))
+        if data[5] & 0x10: # Footer present
+            pos += 10
+    offsets = array("I")
+    sample_rate = samples_per_frame = None
+    while pos + 4 <= len(data):
+        h = int.from_bytes(data[pos:pos + 4], "big")
+        version, layer = (h >> 19) & 3, (h >> 17) & 3
+        br_idx, sr_idx, padding = (h >> 12) & 0xf, (h >> 10) & 3, (h >> 9) & 1
+        if (h >> 21) != 0x7ff or version == 1 or layer != 1 or br_idx in (0, 15) or sr_idx == 3:
+            pos += 1 # Not a frame header; resync byte by byte
+            continue
+        mpeg1 = version == 3
+        sample_rate = MP3_SAMPLE_RATES[version][sr_idx]
+        samples_per_frame = 1152 if mpeg1 else 576
+        offsets.append(pos)
+        pos += (144 if mpeg1 else 72) * MP3_BITRATES[mpeg1][br_idx] * 1000 // sample_rate + padding
+    if not offsets:
+        return None
+    return sample_rate, samples_per_frame, offsets
+
+frame_index_locks = {} # path -> lock, so one file is only ever scanned by one thread at a time
+frame_index_locks_guard = threading.Lock()
+
+def read_frame_index(path):
+    """Returns the saved frame index for path if it still matches the file, else None."""
+    if not path or not path.lower().endswith(".mp3"):
+        return None
+    try:
+        with open(frame_index_path(path), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index["size"] == os.path.getsize(path): # A re-encoded file gets a fresh index
+            return index
+    except Exception:
+        pass
+    return None
+
+def ensure_frame_index(path):
+    """Builds the frame index for path once; returns it, or None for non-MP3 or unreadable files.
+    Never raises. Concurrent callers for the same file wait for a single build."""
+    if not path or not path.lower().endswith(".mp3") or not os.path.exists(path):
+        return None
+    with frame_index_locks_guard:
+        lock = frame_index_locks.setdefault(path, threading.Lock())
+    with lock:
+        index = read_frame_index(path)
+        if index:
+            return index
+        try:
+            size = os.path.getsize(path)
+            scanned = scan_mp3_frames(path)
+        except Exception as e:
+            print("frame index error:", e)
+            return None
+        if not scanned:
+            return None
+        sample_rate, samples_per_frame, offsets = scanned
+        index = {"size": size, "sample_rate": sample_rate, "samples_per_frame": samples_per_frame, "offsets": offsets.tolist()}
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".idx.tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(index, f, separators=(",", ":"))
+            os.replace(tmp, frame_index_path(path))
+        except Exception as e:
+            print("frame index write error:", e) # Still usable from memory for this play
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return index
+
+def frame_duration(index):
+    return index["samples_per_frame"] / index["sample_rate"]
+
 play_lock = threading.Lock()
 current_file = None
 playing = False
 paused = False
+current_stream = None # Open file handed to pygame when playback started mid-file
+current_frame_index = None
+current_duration = None # Length of a non-MP3 song, which has no frame index to derive it from
+play_offset = 0.0 # Track position (seconds) where the current pygame.mixer.music.play() began
+
+def load_resume_positions():
+    if not os.path.exists(RESUME_FILE):
+        return {"last": None, "positions": {}}
+    try:
+        with open(RESUME_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {"last": None, "positions": {}}
+
+def save_resume_positions():
+    with open(RESUME_FILE, "w", encoding="utf-8") as f:
+        json.dump(resume_state, f, indent=2)
+
+resume_state = load_resume_positions()
+
+# --- UI dispatch ---
+# Worker threads never touch Tk directly: they post to ui_pending and drain_ui_queue applies the
+# batch from the main loop once per frame. Posts sharing a key coalesce, so a burst of state
+# changes (e.g. "downloading" then "now playing") costs a single redraw.
+UI_FRAME_MS = 16
+ui_lock = threading.Lock()
+ui_pending = {} # key -> (fn, args), in posting order
+ui_dialogs = [] # (fn, args) of modal dialogs, opened after the keyed state of the same frame
+ui_seq = itertools.count()
+
+def ui_post(fn, *args, key=None):
+    """Schedules fn(*args) on the Tk main loop. Safe to call from any thread."""
+    if key is None:
+        key = next(ui_seq)
+    with ui_lock:
+        ui_pending.pop(key, None) # Re-insert so the newest state also runs last
+        ui_pending[key] = (fn, args)
+
+def ui_dialog(fn, *args):
+    """Schedules a blocking dialog such as messagebox.showerror. Safe to call from any thread."""
+    with ui_lock:
+        ui_dialogs.append((fn, args))
+
+def run_ui_call(fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        print("UI update error:", e)
+
+def drain_ui_queue():
+    global ui_pending, ui_dialogs
+    root.after(UI_FRAME_MS, drain_ui_queue) # Rescheduled first so a modal dialog can't stall later updates
+    with ui_lock:
+        batch, ui_pending = ui_pending, {}
+        dialogs, ui_dialogs = ui_dialogs, []
+    for fn, args in batch.values():
+        run_ui_call(fn, *args)
+    # Dialogs run their own event loop, in which later drains apply newer state; opening them only
+    # once this batch is done means nothing stale from it can overwrite that state afterwards
+    for fn, args in dialogs:
+        root.after_idle(run_ui_call, fn, *args)
+
+def playback_window_open():
+    return hasattr(root, 'playback_window') and root.playback_window.winfo_exists()
+
+def apply_transport_state(enabled):
+    if playback_window_open():
+        state = tk.NORMAL if enabled else tk.DISABLED
+        for btn in (root.playback_window.prev_btn, root.playback_window.play_btn, root.playback_window.pause_btn,
+                    root.playback_window.stop_btn, root.playback_window.next_btn):
+            btn.config(state=state)
+
+def set_transport_enabled(enabled):
+    ui_post(apply_transport_state, enabled, key="transport")
+
+def render_downloading(entry):
+    if playback_window_open():
+        root.playback_window.current_song_label.config(text=f"Downloading: {entry['title']}...")
+        root.playback_window.thumbnail_label.config(image='') # Clear thumbnail during download
+        root.playback_window.thumbnail_label.image = None
+
+def show_downloading(entry):
+    ui_post(render_downloading, entry, key="display")
 
 def update_playback_display(entry=None):
-    """Updates the song title and thumbnail in the playback window."""
-    if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
+    """Queues a refresh of the song title and thumbnail in the playback window."""
+    ui_post(render_playback_display, entry, key="display")
+
+def render_playback_display(entry=None):
+    """Updates the song title and thumbnail in the playback window. Main thread only."""
+    if playback_window_open():
         if entry:
             root.playback_window.current_song_label.config(text=f"Now Playing: {entry['title']}")
             thumb_path = cached_thumbnail_path(entry)
@@ -224,16 +1212,122 @@ def update_playback_display(entry=None):
             root.playback_window.thumbnail_label.config(image='') # Clear image
             root.playback_window.thumbnail_label.image = None
 
-def play_file(path, entry):
+def attach_frame_index(path):
+    """Builds the index in the background and hands it to the player if path is still playing."""
+    global current_frame_index
+    index = ensure_frame_index(path)
+    with play_lock:
+        if index and current_file == path:
+            current_frame_index = index
+
+def attach_duration(path):
+    """Probes a non-MP3 song's length in the background and keeps it in cache.json for next time."""
+    global current_duration
+    try:
+        duration = probe_duration(path)
+    except Exception as e:
+        print("duration probe failed:", e)
+        return
+    if duration is None:
+        return
+    record_cache_duration(path, duration)
+    with play_lock:
+        if current_file == path:
+            current_duration = duration
+
+def load_and_play_at(path, seconds):
+    """Starts path at seconds. Caller holds play_lock."""
+    global current_stream, current_frame_index, current_duration, play_offset
+    previous_stream = current_stream
+    is_mp3 = path.lower().endswith(".mp3")
+    duration = None
+    if not is_mp3:
+        with cache_lock:
+            duration = (cache_index.get(cache_key(path)) or {}).get("duration")
+        if duration is None and path != current_file:
+            threading.Thread(target=attach_duration, args=(path,), daemon=True).start()
+    if is_mp3 and seconds > 0:
+        index = ensure_frame_index(path) # Needed now to find the frame
+    else:
+        # Starting from the top needs no index; never make the first play wait on a scan
+        index = read_frame_index(path)
+        if is_mp3 and index is None:
+            threading.Thread(target=attach_frame_index, args=(path,), daemon=True).start()
+
+    stream = None
+    if index and seconds > 0:
+        try:
+            frame = min(int(seconds / frame_duration(index)), len(index["offsets"]) - 1)
+            stream = open(path, "rb")
+            stream.seek(index["offsets"][frame])
+            pygame.mixer.music.load(stream, "mp3")
+            pygame.mixer.music.play()
+            play_offset = frame * frame_duration(index)
+        except Exception as e:
+            print("indexed seek failed, decoding from the start:", e)
+            if stream:
+                stream.close()
+            stream = None
+    if stream is None:
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.play(start=seconds)
+        play_offset = seconds
+    current_stream = stream
+    current_frame_index = index
+    if path != current_file or duration is not None: # A seek within the song keeps a probed length
+        current_duration = duration
+    if previous_stream:
+        previous_stream.close()
+
+def get_playback_position():
+    """Returns (position, duration) in seconds; duration is None when the track length is unknown."""
+    if not playing:
+        return 0.0, None
+    elapsed = pygame.mixer.music.get_pos()
+    position = play_offset + max(elapsed, 0) / 1000.0
+    if current_frame_index:
+        duration = len(current_frame_index["offsets"]) * frame_duration(current_frame_index)
+    else:
+        duration = current_duration
+    if duration is not None:
+        position = min(position, duration)
+    return position, duration
+
+def seek_to(seconds):
+    global paused
+    with play_lock:
+        if not playing or not current_file:
+            return
+        try:
+            load_and_play_at(current_file, max(0.0, seconds))
+            paused = False
+        except Exception as e:
+            ui_dialog(messagebox.showerror, "Seek error", str(e))
+
+def remember_position():
+    """Stores where the current song was stopped so it can be resumed later. Caller holds play_lock."""
+    if not playing or not current_playing_entry:
+        return
+    position, duration = get_playback_position()
+    positions = resume_state["positions"]
+    positions.pop(current_playing_entry["id"], None)
+    if position > 5 and (duration is None or duration - position > 5):
+        positions[current_playing_entry["id"]] = round(position, 2)
+        while len(positions) > 200: # Oldest first
+            positions.pop(next(iter(positions)))
+    resume_state["last"] = current_playing_entry["id"]
+    save_resume_positions()
+
+def play_file(path, entry, start=0.0):
     global current_file, playing, paused, current_playing_entry
     if not os.path.exists(path):
-        messagebox.showerror("Playback", f"File not found:\n{path}")
+        ui_dialog(messagebox.showerror, "Playback", f"File not found:\n{path}")
         return
 
     with play_lock:
         try:
-            pygame.mixer.music.load(path)
-            pygame.mixer.music.play()
+            remember_position()
+            load_and_play_at(path, start)
             current_file = path
             playing = True
             paused = False
@@ -241,18 +1335,23 @@ def play_file(path, entry):
             append_history(entry["title"], entry["url"])
             update_playback_display(entry) # Update display with new song
         except Exception as e:
-            messagebox.showerror("Playback error", str(e))
+            ui_dialog(messagebox.showerror, "Playback error", str(e))
             update_playback_display(None) # Clear display on error
 
 def stop_playback():
-    global playing, paused, current_file, current_playing_entry, current_song_index
+    global playing, paused, current_file, current_playing_entry, current_stream
     with play_lock:
+        remember_position()
         pygame.mixer.music.stop()
+        if current_stream:
+            pygame.mixer.music.unload()
+            current_stream.close()
+            current_stream = None
         playing = False
         paused = False
         current_file = None
         current_playing_entry = None
-        current_song_index = -1 # Reset index when stopped
+        play_queue.set_current(-1) # The queue keeps its position so Next continues from here
         update_playback_display(None) # Clear display
 
 def pause_resume():
@@ -272,72 +1371,70 @@ def set_volume(val):
     volume = float(val) / 100.0
     pygame.mixer.music.set_volume(volume)
 
+def resume_last_song():
+    last = resume_state.get("last")
+    entry = track_registry.get(last) if last else None
+    if not entry:
+        messagebox.showinfo("Resume", "Nothing to resume.")
+        return
+    path = cached_mp3_path(entry)
+    if not os.path.exists(path):
+        messagebox.showinfo("Resume", f"'{entry['title']}' is no longer downloaded.")
+        return
+    start = resume_state["positions"].get(entry["id"], 0.0)
+    threading.Thread(target=play_file, args=(path, entry, start), daemon=True).start()
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
 # --- Playback Control Functions (Next/Previous) ---
 def play_next_song():
-    global current_song_index, current_playlist_items
     if not current_playlist_items:
         messagebox.showinfo("Playback", "No playlist loaded or empty playlist.")
         return
 
-    next_index = (current_song_index + 1) % len(current_playlist_items)
+    next_index = play_queue.advance()
     # Ensure the next song is played in a new thread to avoid freezing GUI
     threading.Thread(target=play_song_from_playlist, args=(next_index,), daemon=True).start()
 
 
 def play_previous_song():
-    global current_song_index, current_playlist_items
     if not current_playlist_items:
         messagebox.showinfo("Playback", "No playlist loaded or empty playlist.")
         return
 
-    prev_index = (current_song_index - 1 + len(current_playlist_items)) % len(current_playlist_items)
+    prev_index = play_queue.back()
     # Ensure the previous song is played in a new thread to avoid freezing GUI
     threading.Thread(target=play_song_from_playlist, args=(prev_index,), daemon=True).start()
 
 
 def play_song_from_playlist(index):
-    global current_song_index, current_playlist_items
+    """Plays the playlist entry at index; callers move play_queue to it first."""
     if not current_playlist_items or not (0 <= index < len(current_playlist_items)):
-        messagebox.showerror("Playback", "Invalid song index in playlist.")
+        ui_dialog(messagebox.showerror, "Playback", "Invalid song index in playlist.")
         return
 
     entry = current_playlist_items[index]
-    current_song_index = index # Update the global index
+    play_queue.set_current(index)
 
-    mp3p = os.path.join(DOWNLOADS, cleanname(f"{entry['title']} - {entry['id']}.mp3"))
+    mp3p = cached_mp3_path(entry)
     if os.path.exists(mp3p):
         play_file(mp3p, entry) # Call play_file directly, it handles threading for actual playback
     else:
         def dl_play_and_then_play_file():
-            # Update display to show downloading status
-            if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
-                root.playback_window.current_song_label.config(text=f"Downloading: {entry['title']}...")
-                root.playback_window.thumbnail_label.config(image='') # Clear thumbnail during download
-                root.playback_window.thumbnail_label.image = None
-
-            # Disable playback controls during download
-            if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
-                root.playback_window.play_btn.config(state=tk.DISABLED)
-                root.playback_window.pause_btn.config(state=tk.DISABLED)
-                root.playback_window.stop_btn.config(state=tk.DISABLED)
-                root.playback_window.next_btn.config(state=tk.DISABLED)
-                root.playback_window.prev_btn.config(state=tk.DISABLED)
+            # Show downloading status and disable playback controls during download
+            show_downloading(entry)
+            set_transport_enabled(False)
 
             mp3 = download_audio_to_mp3(entry["url"], entry)
             download_thumbnail(entry) # Download thumbnail in parallel
 
-            # Re-enable playback controls
-            if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
-                root.after(0, lambda: root.playback_window.play_btn.config(state=tk.NORMAL))
-                root.after(0, lambda: root.playback_window.pause_btn.config(state=tk.NORMAL))
-                root.after(0, lambda: root.playback_window.stop_btn.config(state=tk.NORMAL))
-                root.after(0, lambda: root.playback_window.next_btn.config(state=tk.NORMAL))
-                root.after(0, lambda: root.playback_window.prev_btn.config(state=tk.NORMAL))
-
+            set_transport_enabled(True)
             if mp3:
                 play_file(mp3, entry)
             else:
-                messagebox.showerror("Download failed", "Could not download playlist item.")
+                ui_dialog(messagebox.showerror, "Download failed", "Could not download playlist item.")
                 update_playback_display(None) # Clear display on failure
         threading.Thread(target=dl_play_and_then_play_file, daemon=True).start()
 
@@ -353,7 +1450,7 @@ def do_search(query):
         results_listbox.delete(0, tk.END)
         for r in search_results:
             results_listbox.insert(tk.END, r["title"])
-    root.after(0, update)
+    ui_post(update, key="search_results")
 
 def on_search(event=None):
     q = search_entry.get().strip()
@@ -363,6 +1460,19 @@ def on_search(event=None):
     results_listbox.insert(tk.END, "Searching...")
     threading.Thread(target=do_search, args=(q,), daemon=True).start()
 
+def on_search_library(event=None):
+    global search_results
+    q = search_entry.get().strip()
+    if not q:
+        return
+    search_results = search_library(q)
+    results_listbox.delete(0, tk.END)
+    if not search_results:
+        results_listbox.insert(tk.END, "No matches in your library.")
+        return
+    for r in search_results:
+        results_listbox.insert(tk.END, ("(offline) " if r.id in library_cached else "") + r["title"])
+
 def on_play_search_result():
     sel = results_listbox.curselection()
     if not sel:
@@ -372,10 +1482,9 @@ def on_play_search_result():
     entry = search_results[idx]
 
     # When playing from search results, clear playlist context
-    global current_playlist_name, current_playlist_items, current_song_index
+    global current_playlist_name, current_playlist_items
     current_playlist_name = None
     current_playlist_items = []
-    current_song_index = -1
 
     mp3_path = cached_mp3_path(entry)
     if os.path.exists(mp3_path):
@@ -383,30 +1492,18 @@ def on_play_search_result():
         download_thumbnail(entry) # Ensure thumbnail is downloaded even if MP3 is cached
         return
     def dl_then_play():
-        if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
-            root.playback_window.play_btn.config(state=tk.DISABLED)
-            root.playback_window.stop_btn.config(state=tk.DISABLED)
-            root.playback_window.pause_btn.config(state=tk.DISABLED)
-            root.playback_window.next_btn.config(state=tk.DISABLED) # Disable next/prev
-            root.playback_window.prev_btn.config(state=tk.DISABLED) # Disable next/prev
-            root.playback_window.current_song_label.config(text=f"Downloading: {entry['title']}...")
-            root.playback_window.thumbnail_label.config(image='') # Clear thumbnail during download
-            root.playback_window.thumbnail_label.image = None
+        set_transport_enabled(False)
+        show_downloading(entry)
         try:
             mp3 = download_audio_to_mp3(entry["url"], entry)
             download_thumbnail(entry) # Download thumbnail in parallel
             if not mp3:
-                messagebox.showerror("Download failed", "Could not download/convert the song.")
+                ui_dialog(messagebox.showerror, "Download failed", "Could not download/convert the song.")
                 update_playback_display(None)
             else:
                 threading.Thread(target=play_file, args=(mp3, entry), daemon=True).start()
         finally:
-            if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
-                root.after(0, lambda: root.playback_window.play_btn.config(state=tk.NORMAL))
-                root.after(0, lambda: root.playback_window.stop_btn.config(state=tk.NORMAL))
-                root.after(0, lambda: root.playback_window.pause_btn.config(state=tk.NORMAL))
-                root.after(0, lambda: root.playback_window.next_btn.config(state=tk.NORMAL)) # Re-enable next/prev
-                root.after(0, lambda: root.playback_window.prev_btn.config(state=tk.NORMAL)) # Re-enable next/prev
+            set_transport_enabled(True)
     threading.Thread(target=dl_then_play, daemon=True).start()
 
 def on_stop():
@@ -465,9 +1562,12 @@ def add_selected_to_playlist():
             # This is a simplified approach; a more robust solution might re-extract info
             # or prompt the user. For now, we'll just add it without thumbnail if missing.
             pass
-        item = {"title": entry["title"], "url": entry["url"], "id": entry["id"], "thumbnail": entry.get("thumbnail")}
-        playlists[pick].append(item)
+        playlists[pick].append(entry) # The shared Track itself, not a copy
         save_playlists(playlists)
+        if pick == play_queue.playlist:
+            play_queue.appended(len(playlists[pick]) - 1)
+            play_queue.save()
+        index_track(entry)
         messagebox.showinfo("Playlist", f"Added to {pick}")
         win.destroy()
 
@@ -492,7 +1592,7 @@ def open_playlist_window():
         lb.insert(tk.END, pl)
 
     def open_selected_playlist_action():
-        global current_playlist_name, current_playlist_items, current_song_index, current_playing_entry
+        global current_playlist_name, current_playlist_items
         sel = lb.curselection()
         if not sel:
             messagebox.showinfo("Select", "Select a playlist first.")
@@ -503,159 +1603,113 @@ def open_playlist_window():
         # Set global playlist context
         current_playlist_name = chosen_playlist_name
         current_playlist_items = playlists[chosen_playlist_name]
-        current_song_index = -1 # Reset index when a new playlist is opened
+        play_queue.attach(chosen_playlist_name, len(current_playlist_items))
 
         playlist_win = tk.Toplevel(root)
         playlist_win.title(f"Playlist: {chosen_playlist_name}")
         playlist_lb = tk.Listbox(playlist_win, width=80, height=15)
         playlist_lb.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        for it in current_playlist_items: # Use global items for display
-            playlist_lb.insert(tk.END, it["title"])
+
+        def refresh_listbox():
+            # Rows follow the play queue order; row n is current_playlist_items[play_queue.order[n]]
+            playlist_lb.delete(0, tk.END)
+            for i in play_queue.rows():
+                playlist_lb.insert(tk.END, current_playlist_items[i]["title"])
+        refresh_listbox()
 
         def play_from_playlist_selected():
             sel = playlist_lb.curselection()
             if not sel:
                 return
-            index_to_play = sel[0]
+            index_to_play = play_queue.jump(sel[0])
             threading.Thread(target=play_song_from_playlist, args=(index_to_play,), daemon=True).start()
 
+        def play_selected_next():
+            sel = playlist_lb.curselection()
+            if not sel:
+                messagebox.showinfo("Play Next", "Select one or more songs first.")
+                return
+            for index in play_queue.at(sel):
+                play_queue.play_next(index)
+            play_queue.save_state()
+
         def remove_selected_from_playlist():
-            global current_playlist_items, current_song_index, current_playing_entry
             sel_indices = playlist_lb.curselection()
             if not sel_indices:
                 messagebox.showinfo("Remove", "Select one or more songs to remove.")
                 return
 
-            # Convert tuple of indices to a list and sort in descending order
+            # Map rows to playlist indices and delete in descending order
             # This is important to avoid index shifting issues when deleting multiple items
-            indices_to_remove = sorted(list(sel_indices), reverse=True)
+            indices_to_remove = sorted(play_queue.at(sel_indices), reverse=True)
 
             for idx in indices_to_remove:
-                if 0 <= idx < len(current_playlist_items):
-                    removed_entry = current_playlist_items.pop(idx)
-                    # If the removed song was the currently playing one, stop playback
-                    if current_playing_entry and removed_entry['id'] == current_playing_entry['id']:
-                        stop_playback()
-                    # Adjust current_song_index if a song before it was removed
-                    if current_song_index != -1 and idx < current_song_index:
-                        current_song_index -= 1
-
-            # Update the listbox display
-            playlist_lb.delete(0, tk.END)
-            for it in current_playlist_items:
-                playlist_lb.insert(tk.END, it["title"])
+                removed_entry = current_playlist_items.pop(idx)
+                # If the removed song was the currently playing one, stop playback
+                if current_playing_entry and removed_entry['id'] == current_playing_entry['id']:
+                    stop_playback()
+            play_queue.removed(indices_to_remove)
+
+            refresh_listbox()
 
             # Save the updated playlist
             playlists[current_playlist_name] = current_playlist_items
             save_playlists(playlists)
+            play_queue.save()
             messagebox.showinfo("Remove", "Selected song(s) removed from playlist.")
 
 
         def play_sequentially_from_start():
             # This will start playing from the first song or selected song
             sel = playlist_lb.curselection()
-            start_index = sel[0] if sel else 0
-            threading.Thread(target=play_song_from_playlist_sequence, args=(start_index,), daemon=True).start()
-
-        def play_song_from_playlist_sequence(index):
-            global current_song_index, current_playlist_items
-            if index >= len(current_playlist_items):
-                stop_playback() # End of playlist
+            start_position = sel[0] if sel else 0
+            if not play_queue.rows():
                 return
+            threading.Thread(target=play_song_from_playlist_sequence, args=(play_queue.jump(start_position),), daemon=True).start()
 
-            entry = current_playlist_items[index]
-            current_song_index = index # Update global index
-
-            mp3p = os.path.join(DOWNLOADS, cleanname(f"{entry['title']} - {entry['id']}.mp3"))
-            if os.path.exists(mp3p):
-                play_file(mp3p, entry)
-            else:
-                # Disable playback controls during download
-                if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
-                    root.playback_window.play_btn.config(state=tk.DISABLED)
-                    root.playback_window.pause_btn.config(state=tk.DISABLED)
-                    root.playback_window.stop_btn.config(state=tk.DISABLED)
-                    root.playback_window.next_btn.config(state=tk.DISABLED)
-                    root.playback_window.prev_btn.config(state=tk.DISABLED)
-                    root.playback_window.current_song_label.config(text=f"Downloading: {entry['title']}...")
-                    root.playback_window.thumbnail_label.config(image='') # Clear thumbnail during download
-                    root.playback_window.thumbnail_label.image = None
-
-                mp3 = download_audio_to_mp3(entry["url"], entry)
-                download_thumbnail(entry) # Download thumbnail in parallel
-
-                # Re-enable playback controls
-                if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
-                    root.playback_window.play_btn.config(state=tk.NORMAL)
-                    root.playback_window.pause_btn.config(state=tk.NORMAL)
-                    root.playback_window.stop_btn.config(state=tk.NORMAL)
-                    root.playback_window.next_btn.config(state=tk.NORMAL)
-                    root.playback_window.prev_btn.config(state=tk.NORMAL)
+        def play_song_from_playlist_sequence(index):
+            while index is not None:
+                entry = current_playlist_items[index]
+                play_queue.set_current(index)
 
-                if mp3:
-                    play_file(mp3, entry)
+                mp3p = cached_mp3_path(entry)
+                if os.path.exists(mp3p):
+                    play_file(mp3p, entry)
                 else:
-                    messagebox.showerror("Download failed", f"Could not download {entry['title']}.")
-                    update_playback_display(None)
+                    # Disable playback controls during download
+                    set_transport_enabled(False)
+                    show_downloading(entry)
+
+                    mp3 = download_audio_to_mp3(entry["url"], entry)
+                    download_thumbnail(entry) # Download thumbnail in parallel
+
+                    set_transport_enabled(True)
+                    if mp3:
+                        play_file(mp3, entry)
+                    else:
+                        ui_dialog(messagebox.showerror, "Download failed", f"Could not download {entry['title']}.")
+                        update_playback_display(None)
+                        return
+
+                # Wait for current song to finish before playing next (this is a worker thread, so no Tk calls here)
+                while pygame.mixer.music.get_busy() or (playing and paused):
+                    time.sleep(0.25)
+                if not playing: # Stopped by the user
                     return
-
-            # Wait for current song to finish before playing next
-            while pygame.mixer.music.get_busy():
-                root.update()
-            play_song_from_playlist_sequence(index + 1)
-
+                index = play_queue.advance(wrap=False)
+            stop_playback() # End of playlist
 
         def shuffle_playlist_action():
-            global current_playlist_items, current_song_index, current_playing_entry
             if not current_playlist_items: return
-
-            # Store the ID of the currently playing song, if any
-            playing_id = current_playing_entry['id'] if current_playing_entry else None
-
-            import random
-            random.shuffle(current_playlist_items) # Shuffle the global list
-
-            # Update the listbox display
-            playlist_lb.delete(0, tk.END)
-            for it in current_playlist_items:
-                playlist_lb.insert(tk.END, it["title"])
-
-            # Update current_song_index if the playing song is still in the list
-            if playing_id:
-                try:
-                    current_song_index = next(i for i, item in enumerate(current_playlist_items) if item['id'] == playing_id)
-                except StopIteration:
-                    current_song_index = -1 # Song no longer in playlist or not found
-            else:
-                current_song_index = -1 # No song was playing
-
-            # Save the shuffled order to the actual playlists dictionary
-            playlists[current_playlist_name] = current_playlist_items
-            save_playlists(playlists)
+            play_queue.shuffle() # Reorders the queue only; the saved playlist keeps its order
+            refresh_listbox()
+            play_queue.save()
 
         def sort_playlist_action():
-            global current_playlist_items, current_song_index, current_playing_entry
             if not current_playlist_items: return
-
-            playing_id = current_playing_entry['id'] if current_playing_entry else None
-
-            current_playlist_items.sort(key=lambda x: x["title"].lower()) # Sort the global list
-
-            playlist_lb.delete(0, tk.END)
-            for it in current_playlist_items:
-                playlist_lb.insert(tk.END, it["title"])
-
-            if playing_id:
-                try:
-                    current_song_index = next(i for i, item in enumerate(current_playlist_items) if item['id'] == playing_id)
-                except StopIteration:
-                    current_song_index = -1
-            else:
-                current_song_index = -1
-
-            # Save the sorted order to the actual playlists dictionary
-            playlists[current_playlist_name] = current_playlist_items
-            save_playlists(playlists)
+            play_queue.sort(current_playlist_items, key=lambda t: t.title.lower())
+            refresh_listbox()
+            play_queue.save()
 
         # Frame for playlist control buttons
         playlist_buttons_frame = tk.Frame(playlist_win)
@@ -663,12 +1717,38 @@ def open_playlist_window():
 
         tk.Button(playlist_buttons_frame, text="Play Selected", command=play_from_playlist_selected).pack(side=tk.LEFT, padx=4)
         tk.Button(playlist_buttons_frame, text="Play All", command=play_sequentially_from_start).pack(side=tk.LEFT, padx=4)
+        tk.Button(playlist_buttons_frame, text="Play Next", command=play_selected_next).pack(side=tk.LEFT, padx=4)
         tk.Button(playlist_buttons_frame, text="Shuffle", command=shuffle_playlist_action).pack(side=tk.LEFT, padx=4)
         tk.Button(playlist_buttons_frame, text="Sort Alphabetically", command=sort_playlist_action).pack(side=tk.LEFT, padx=4)
         tk.Button(playlist_buttons_frame, text="Remove Selected", command=remove_selected_from_playlist).pack(side=tk.LEFT, padx=4) # New button
 
     tk.Button(win, text="Open", command=open_selected_playlist_action).pack(pady=8, side=tk.BOTTOM)
 
+def shrink_library():
+    codec = simpledialog.askstring("Shrink Library", "Codec (mp3 or ogg):", initialvalue="mp3")
+    if not codec:
+        return
+    codec = codec.strip().lower()
+    if codec not in TRANSCODE_CODECS:
+        messagebox.showerror("Shrink Library", f"Unsupported codec: {codec}")
+        return
+    bitrate = simpledialog.askinteger("Shrink Library", "Target bitrate (kbps):", initialvalue=128, minvalue=32, maxvalue=320)
+    if not bitrate:
+        return
+    repair = messagebox.askyesno("Shrink Library", "Also check every file and repair the ones that fail to decode? (slower)")
+
+    def run():
+        try:
+            converted, failed, saved = transcode_library(codec, bitrate, repair=repair)
+        except Exception as e:
+            ui_dialog(messagebox.showerror, "Shrink Library", str(e))
+            return
+        msg = f"Re-encoded {converted} file(s), saved {saved / (1024 * 1024):.1f} MB."
+        if failed:
+            msg += f"\n{len(failed)} file(s) failed and were left unchanged."
+        ui_dialog(messagebox.showinfo, "Shrink Library", msg)
+    threading.Thread(target=run, daemon=True).start()
+
 # --- Playback Control Window ---
 def open_playback_window():
     if hasattr(root, 'playback_window') and root.playback_window.winfo_exists():
@@ -677,7 +1757,7 @@ def open_playback_window():
 
     playback_win = tk.Toplevel(root)
     playback_win.title("Playback Controls")
-    playback_win.geometry("300x300") # Increased height for thumbnail and next/prev buttons
+    playback_win.geometry("300x400") # Increased height for thumbnail, progress bar and transport buttons
     playback_win.resizable(False, False)
 
     root.playback_window = playback_win
@@ -705,6 +1785,36 @@ def open_playback_window():
     playback_win.next_btn = tk.Button(playback_controls_frame, text="Next >>", command=play_next_song)
     playback_win.next_btn.pack(side=tk.LEFT, padx=2)
 
+    # Position display and seek bar
+    playback_win.position_label = tk.Label(playback_win, text="0:00 / 0:00")
+    playback_win.position_label.pack()
+    playback_win.seek_bar = tk.Scale(playback_win, from_=0, to=0, orient=tk.HORIZONTAL, showvalue=False, length=260)
+    playback_win.seek_bar.pack(padx=10)
+    playback_win.seeking = False
+
+    def on_seek_press(event):
+        playback_win.seeking = True
+
+    def on_seek_release(event):
+        playback_win.seeking = False
+        threading.Thread(target=seek_to, args=(playback_win.seek_bar.get(),), daemon=True).start()
+
+    playback_win.seek_bar.bind("<ButtonPress-1>", on_seek_press)
+    playback_win.seek_bar.bind("<ButtonRelease-1>", on_seek_release)
+    tk.Button(playback_win, text="Resume Last", command=resume_last_song).pack(pady=(4, 0))
+
+    def refresh_position():
+        # Low-rate timer; the seek bar is left alone while the user is dragging it
+        if not playback_win.winfo_exists():
+            return
+        position, duration = get_playback_position()
+        playback_win.position_label.config(text=f"{format_time(position)} / {format_time(duration) if duration else '?:??'}")
+        if not playback_win.seeking:
+            playback_win.seek_bar.config(to=int(duration or 0))
+            playback_win.seek_bar.set(int(position))
+        playback_win.after(500, refresh_position)
+    refresh_position()
+
     # Volume Slider
     volume_frame = tk.Frame(playback_win)
     volume_frame.pack(pady=10)
@@ -715,7 +1825,7 @@ def open_playback_window():
 
 
     # Initial display update
-    update_playback_display(current_playing_entry)
+    render_playback_display(current_playing_entry)
 
 # --- Splash Screen Function ---
 def show_splash_screen():
@@ -781,6 +1891,7 @@ if __name__ == "__main__":
     search_entry.bind("<Return>", on_search)
 
     tk.Button(top, text="Search", width=10, command=on_search).pack(side=tk.LEFT)
+    tk.Button(top, text="Search Library", width=14, command=on_search_library).pack(side=tk.LEFT, padx=(6,0))
 
     middle = tk.Frame(root)
     middle.pack(fill=tk.BOTH, expand=True, padx=8)
@@ -800,6 +1911,17 @@ if __name__ == "__main__":
     tk.Button(controls, text="Open Playlist", width=14, command=open_playlist_window).grid(row=0, column=2, padx=4)
     tk.Button(controls, text="Open Playback Controls", width=20, command=open_playback_window).grid(row=0, column=3, padx=4)
 
+    tk.Button(controls, text="Shrink Library", width=14, command=shrink_library).grid(row=0, column=4, padx=4)
+
+    upgrade_var = tk.BooleanVar(value=background_upgrade_enabled)
+    def toggle_background_upgrade():
+        global background_upgrade_enabled
+        background_upgrade_enabled = upgrade_var.get()
+    tk.Checkbutton(controls, text="Upgrade quick downloads to high quality when idle", variable=upgrade_var,
+                   command=toggle_background_upgrade).grid(row=1, column=0, columnspan=5, pady=(4, 0))
+    threading.Thread(target=background_upgrade_loop, daemon=True).start()
+
     tk.Button(root, text="Open Downloads Folder", command=lambda: os.startfile(str(DOWNLOADS))).pack(pady=6)
-    root.protocol("WM_DELETE_WINDOW", lambda: (stop_playback(), root.destroy()))
+    root.after(UI_FRAME_MS, drain_ui_queue)
+    root.protocol("WM_DELETE_WINDOW", lambda: (stop_playback(), play_queue.save(), save_library_index(), root.destroy()))
     root.mainloop()